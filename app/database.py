@@ -1,29 +1,77 @@
 """SQLite helpers for tour registrations without external ORM dependencies."""
 from __future__ import annotations
 
+import logging
+import queue
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
-from datetime import date, datetime, timedelta
+from datetime import date, timedelta
 from pathlib import Path
-from typing import Generator, List, Optional, Tuple
+from typing import Dict, Generator, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 DATABASE_PATH = Path("tour.db")
+POOL_SIZE = 4
+STATEMENT_CACHE_SIZE = 256
+
+_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
+
+_pool: Optional[queue.Queue] = None
+_pool_lock = threading.Lock()
+# SQLite serializes writers anyway; taking the lock in Python avoids
+# SQLITE_BUSY errors when two pooled connections write at once.
+_write_lock = threading.Lock()
+
+# Bumped after every committed write so cached listings are rebuilt lazily.
+# They also advance every LISTING_TTL_SECONDS so writes made by other worker
+# processes become visible without a restart.
+_tours_version = 0
+_courses_version = 0
+LISTING_TTL_SECONDS = 30.0
+_listings_expire_at = 0.0
+
+# Conversations idle for longer than this are deleted by a sweep that runs
+# once every CONVERSATION_SWEEP_EVERY saves.
+CONVERSATION_TTL_SECONDS = 24 * 60 * 60
+CONVERSATION_SWEEP_EVERY = 512
+_conversation_saves = 0
+# date.toordinal() in SQL: julianday('0001-01-01') is 1721425.5 and
+# date(1, 1, 1).toordinal() is 1.
+_DATE_ORD_SQL = "CAST(julianday({}) - 1721424.5 AS INTEGER)"
+_TOUR_COLUMNS = "id, date_ord, capacity, registered, status"
+_COURSE_COLUMNS = "id, name, capacity_available, waitlist_count"
+
+_listing_cache: Dict[str, Tuple[int, tuple]] = {}
+_course_index: Tuple[int, Dict[str, Course]] = (-1, {})
+_tour_lookup: Tuple[int, Tuple[TourDate, ...], Dict[str, TourDate]] = (-1, (), {})
 
 ORDINAL_KEYWORDS = {
     "primera": 1,
+    "primero": 1,
     "primer": 1,
     "segunda": 2,
     "segundo": 2,
     "tercera": 3,
+    "tercero": 3,
     "tercer": 3,
     "cuarta": 4,
     "cuarto": 4,
     "quinta": 5,
     "quinto": 5,
 }
+_ORDINAL_RE = re.compile(r"\b(" + "|".join(map(re.escape, ORDINAL_KEYWORDS)) + r")\b")
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class TourDate:
     id: int
     date: date
@@ -36,7 +84,7 @@ class TourDate:
         return max(self.capacity - self.registered, 0)
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Course:
     id: int
     name: str
@@ -48,7 +96,7 @@ class Course:
         return self.capacity_available <= 0
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Registration:
     id: int
     first_name: str
@@ -60,13 +108,59 @@ class Registration:
     wait_listed: bool
 
 
-def _get_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DATABASE_PATH)
+def _open_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
     conn.row_factory = sqlite3.Row
+    journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    if journal_mode.lower() == "wal":
+        # Commits only append to the WAL; fsync happens at checkpoints.
+        conn.execute("PRAGMA synchronous=NORMAL")
+    else:
+        # NORMAL is not crash-safe with a rollback journal, so keep FULL.
+        logger.warning("SQLite WAL unavailable (journal_mode=%s)", journal_mode)
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
+def _get_pool() -> queue.Queue:
+    """Lazily open `POOL_SIZE` long-lived connections shared by all requests."""
+
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool: queue.Queue = queue.Queue(maxsize=POOL_SIZE)
+                for _ in range(POOL_SIZE):
+                    pool.put(_open_connection())
+                _pool = pool
+    return _pool
+
+
+def _get_connection() -> sqlite3.Connection:
+    # Never block on an empty pool: open a temporary overflow connection.
+    try:
+        return _get_pool().get_nowait()
+    except queue.Empty:
+        return _open_connection()
+
+
+def _release_connection(conn: sqlite3.Connection) -> None:
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _get_pool().put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
 def init_db(seed_days: int = 4) -> None:
+    global _tours_version, _courses_version
+
     conn = _get_connection()
     try:
         conn.execute(
@@ -74,6 +168,7 @@ def init_db(seed_days: int = 4) -> None:
             CREATE TABLE IF NOT EXISTS tour_dates (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 date TEXT NOT NULL UNIQUE,
+                date_ord INTEGER NOT NULL DEFAULT 0,
                 capacity INTEGER NOT NULL DEFAULT 12,
                 registered INTEGER NOT NULL DEFAULT 0,
                 status TEXT NOT NULL DEFAULT 'open'
@@ -105,47 +200,131 @@ def init_db(seed_days: int = 4) -> None:
             )
             """
         )
-        count = conn.execute("SELECT COUNT(*) FROM tour_dates").fetchone()[0]
-        if count == 0:
-            today = date.today()
-            for offset in range(1, seed_days + 1):
-                day = today + timedelta(days=offset * 3)
-                conn.execute(
-                    "INSERT INTO tour_dates(date, capacity, registered, status) VALUES (?, ?, 0, 'open')",
-                    (day.isoformat(), 12 if offset % 2 == 0 else 10),
-                )
-        course_count = conn.execute("SELECT COUNT(*) FROM courses").fetchone()[0]
-        if course_count == 0:
-            seeds = [
-                ("Inicial", 6),
-                ("1° EGB", 4),
-                ("2° EGB", 2),
-                ("3° EGB", 1),
-                ("4° EGB", 0),
-                ("5° EGB", 0),
-                ("6° EGB", 3),
-            ]
-            conn.executemany(
-                "INSERT INTO courses(name, capacity_available, waitlist_count) VALUES (?, ?, 0)",
-                seeds,
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                summary TEXT NOT NULL,
+                history BLOB NOT NULL,
+                state BLOB NOT NULL,
+                evicted INTEGER NOT NULL DEFAULT 0,
+                updated_at INTEGER NOT NULL
+            )
+            """
+        )
+        _add_date_ord_column(conn)
+        # date_ord is derived from date, so rows inserted or edited without it
+        # (by hand, or by another tool) never keep the 0 default, which
+        # date.fromordinal() rejects.
+        for name, event in (("insert", "INSERT"), ("update", "UPDATE OF date, date_ord")):
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS trg_tour_dates_date_ord_{name} AFTER {event} ON tour_dates "
+                f"WHEN NEW.date_ord IS NOT {_DATE_ORD_SQL.format('NEW.date')} BEGIN "
+                f"UPDATE tour_dates SET date_ord = {_DATE_ORD_SQL.format('NEW.date')} "
+                "WHERE id = NEW.id; END"
             )
-        conn.commit()
+        # Covers every column in _TOUR_COLUMNS (id is the rowid) in date order.
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_tour_dates_active_cover "
+            "ON tour_dates(date_ord, status, capacity, registered)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at)"
+        )
+        with conn:
+            if conn.execute("SELECT 1 FROM tour_dates LIMIT 1").fetchone() is None:
+                today = date.today()
+                seed_dates = [today + timedelta(days=offset * 3) for offset in range(1, seed_days + 1)]
+                tour_seeds = [
+                    (day.isoformat(), day.toordinal(), 12 if offset % 2 == 0 else 10)
+                    for offset, day in enumerate(seed_dates, start=1)
+                ]
+                conn.executemany(
+                    "INSERT INTO tour_dates(date, date_ord, capacity, registered, status) VALUES (?, ?, ?, 0, 'open')",
+                    tour_seeds,
+                )
+            if conn.execute("SELECT 1 FROM courses LIMIT 1").fetchone() is None:
+                seeds = [
+                    ("Inicial", 6),
+                    ("1° EGB", 4),
+                    ("2° EGB", 2),
+                    ("3° EGB", 1),
+                    ("4° EGB", 0),
+                    ("5° EGB", 0),
+                    ("6° EGB", 3),
+                ]
+                conn.executemany(
+                    "INSERT INTO courses(name, capacity_available, waitlist_count) VALUES (?, ?, 0)",
+                    seeds,
+                )
+        _tours_version += 1
+        _courses_version += 1
     finally:
-        conn.close()
+        _release_connection(conn)
 
 
-def get_db_session() -> Generator[sqlite3.Connection, None, None]:
+def _add_date_ord_column(conn: sqlite3.Connection) -> None:
+    """Backfill `date_ord` (``date.toordinal()``) on databases created before it existed."""
+
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(tour_dates)")}
+    if "date_ord" in columns:
+        return
+    with conn:
+        conn.execute("ALTER TABLE tour_dates ADD COLUMN date_ord INTEGER NOT NULL DEFAULT 0")
+        conn.execute(f"UPDATE tour_dates SET date_ord = {_DATE_ORD_SQL.format('date')}")
+
+
+@contextmanager
+def db_connection() -> Iterator[sqlite3.Connection]:
+    """Borrow a pooled connection for one block of DB work.
+
+    Chat turns borrow one before and one after the LLM round-trip instead
+    of holding a connection idle while the model answers, so a small pool
+    serves many concurrent turns without overflow connections.
+    """
     conn = _get_connection()
     try:
         yield conn
     finally:
-        conn.close()
+        _release_connection(conn)
+
+
+def get_db_session() -> Generator[sqlite3.Connection, None, None]:
+    with db_connection() as conn:
+        yield conn
+
+
+def refresh_listings() -> None:
+    """Force the next listing read to hit SQLite, e.g. to see other workers' writes."""
+
+    global _tours_version, _courses_version
+    _tours_version += 1
+    _courses_version += 1
+
+
+def _expire_listings() -> None:
+    global _listings_expire_at
+    now = time.monotonic()
+    if now >= _listings_expire_at:
+        _listings_expire_at = now + LISTING_TTL_SECONDS
+        refresh_listings()
+
+
+def tours_version() -> int:
+    _expire_listings()
+    return _tours_version
+
+
+def courses_version() -> int:
+    _expire_listings()
+    return _courses_version
 
 
 def _row_to_tour(row: sqlite3.Row) -> TourDate:
     return TourDate(
         id=row["id"],
-        date=datetime.fromisoformat(row["date"]).date(),
+        date=date.fromordinal(row["date_ord"]),
         capacity=row["capacity"],
         registered=row["registered"],
         status=row["status"],
@@ -153,39 +332,73 @@ def _row_to_tour(row: sqlite3.Row) -> TourDate:
 
 
 def list_active_tours(conn: sqlite3.Connection) -> List[TourDate]:
-    rows = conn.execute(
-        "SELECT * FROM tour_dates WHERE status != 'closed' ORDER BY date ASC"
-    ).fetchall()
-    return [_row_to_tour(row) for row in rows]
+    _expire_listings()
+    cached = _listing_cache.get("tours")
+    if cached is None or cached[0] != _tours_version:
+        version = _tours_version
+        rows = conn.execute(
+            f"SELECT {_TOUR_COLUMNS} FROM tour_dates WHERE status != 'closed' ORDER BY date_ord ASC"
+        ).fetchall()
+        cached = (version, tuple(_row_to_tour(row) for row in rows))
+        _listing_cache["tours"] = cached
+    return list(cached[1])
+
+
+def get_tour_by_id(conn: sqlite3.Connection, tour_id: int) -> Optional[TourDate]:
+    row = conn.execute(
+        f"SELECT {_TOUR_COLUMNS} FROM tour_dates WHERE id = ? AND status != 'closed'",
+        (tour_id,),
+    ).fetchone()
+    return _row_to_tour(row) if row else None
+
+
+def _match_tokens(day: date) -> Tuple[str, ...]:
+    """Date formats accepted by find_tour_by_input."""
+    return (
+        day.strftime("%d/%m/%Y"),
+        day.strftime("%Y-%m-%d"),
+        day.strftime("%d/%m"),
+        str(day.day),
+    )
+
+
+def _tour_index(conn: sqlite3.Connection) -> Tuple[Tuple[TourDate, ...], Dict[str, TourDate]]:
+    """Active tours in order, plus every prefix of their match tokens -> first tour.
+
+    Rebuilt only when the tours change, so resolving a user's choice is a
+    dict probe instead of a scan over every tour's formatted dates.
+    """
+
+    global _tour_lookup
+    _expire_listings()
+    version = _tours_version
+    if _tour_lookup[0] != version:
+        tours = tuple(list_active_tours(conn))
+        by_prefix: Dict[str, TourDate] = {}
+        for tour in tours:
+            for token in _match_tokens(tour.date):
+                for end in range(1, len(token) + 1):
+                    by_prefix.setdefault(token[:end], tour)
+        _tour_lookup = (version, tours, by_prefix)
+    return _tour_lookup[1], _tour_lookup[2]
 
 
 def find_tour_by_input(conn: sqlite3.Connection, user_choice: str) -> Optional[TourDate]:
     user_choice = user_choice.strip().lower()
-    tours = list_active_tours(conn)
-    if not tours:
-        return None
+    tours, by_prefix = _tour_index(conn)
 
     if user_choice.isdigit():
-        idx = int(user_choice) - 1
-        if 0 <= idx < len(tours):
-            return tours[idx]
-
-    for keyword, index in ORDINAL_KEYWORDS.items():
-        if keyword in user_choice:
-            idx = index - 1
-            if 0 <= idx < len(tours):
-                return tours[idx]
-
-    for tour in tours:
-        options = [
-            tour.date.strftime("%d/%m/%Y"),
-            tour.date.strftime("%Y-%m-%d"),
-            tour.date.strftime("%d/%m"),
-            str(tour.date.day),
-        ]
-        if any(opt.startswith(user_choice) for opt in options):
-            return tour
-    return None
+        position = int(user_choice) - 1
+        if 0 <= position < len(tours):
+            return tours[position]
+
+    ordinal = _ORDINAL_RE.search(user_choice)
+    if ordinal:
+        position = ORDINAL_KEYWORDS[ordinal.group(1)] - 1
+        if position < len(tours):
+            return tours[position]
+
+    return by_prefix.get(user_choice)
 
 
 def _row_to_course(row: sqlite3.Row) -> Course:
@@ -198,67 +411,87 @@ def _row_to_course(row: sqlite3.Row) -> Course:
 
 
 def list_courses(conn: sqlite3.Connection) -> List[Course]:
-    rows = conn.execute("SELECT * FROM courses ORDER BY id ASC").fetchall()
-    return [_row_to_course(row) for row in rows]
-
-
-def _find_course_match(courses: List[Course], grade: str) -> Optional[Course]:
-    g = grade.strip().lower()
-    for course in courses:
-        name = course.name.lower()
-        if g == name:
-            return course
-        if g in name or name in g:
-            return course
-    return None
+    _expire_listings()
+    cached = _listing_cache.get("courses")
+    if cached is None or cached[0] != _courses_version:
+        version = _courses_version
+        rows = conn.execute(f"SELECT {_COURSE_COLUMNS} FROM courses ORDER BY id ASC").fetchall()
+        cached = (version, tuple(_row_to_course(row) for row in rows))
+        _listing_cache["courses"] = cached
+    return list(cached[1])
+
+
+def _courses_by_name(conn: sqlite3.Connection) -> Dict[str, Course]:
+    """Lowercase course name -> Course, rebuilt only when the courses change."""
+
+    global _course_index
+    version = _courses_version
+    if _course_index[0] != version:
+        _course_index = (version, {course.name.lower(): course for course in list_courses(conn)})
+    return _course_index[1]
+
+
+def _find_course_match(conn: sqlite3.Connection, g: str) -> Optional[Course]:
+    """Fuzzy SQL lookup; `g` must already be stripped and lowercased."""
+
+    pattern = "%" + g.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    row = conn.execute(
+        f"""
+        SELECT {_COURSE_COLUMNS} FROM courses
+        WHERE name = ? COLLATE NOCASE
+           OR lower(name) LIKE ? ESCAPE '\\'
+           OR ? LIKE '%' || lower(name) || '%'
+        ORDER BY id ASC
+        LIMIT 1
+        """,
+        (g, pattern, g),
+    ).fetchone()
+    return _row_to_course(row) if row else None
 
 
 def reserve_course_interest(conn: sqlite3.Connection, grades: List[str]) -> dict:
     """Reduce capacidad disponible por grado y refleja si alguna se lista en espera."""
 
-    courses = list_courses(conn)
-    wait_listed = False
-    matched = []
+    global _courses_version
 
+    # The cached listing only resolves names to ids. Whether a seat is left is
+    # decided by the UPDATE itself, so a stale cache or another worker taking
+    # the last seat can't oversell a course.
+    by_name = _courses_by_name(conn)
+    courses: List[Course] = []
     for grade in grades:
-        course = _find_course_match(courses, grade)
+        key = grade.strip().lower()
+        course = by_name.get(key) or _find_course_match(conn, key)
         if not course:
+            logger.warning("No course matches grade %r", grade)
             continue
+        courses.append(course)
 
-        status = "available"
-        if course.is_full:
-            wait_listed = True
-            status = "waitlist"
-            conn.execute(
-                "UPDATE courses SET waitlist_count = waitlist_count + 1 WHERE id = ?",
-                (course.id,),
-            )
-        else:
-            conn.execute(
-                "UPDATE courses SET capacity_available = capacity_available - 1 WHERE id = ?",
-                (course.id,),
-            )
-            course.capacity_available -= 1
-
-        matched.append({"course": course.name, "status": status})
+    wait_listed = False
+    matched = []
+    if courses:
+        with _write_lock:
+            with conn:
+                for course in courses:
+                    taken = conn.execute(
+                        "UPDATE courses SET capacity_available = capacity_available - 1 "
+                        "WHERE id = ? AND capacity_available > 0",
+                        (course.id,),
+                    ).rowcount
+                    status = "available"
+                    if not taken:
+                        status = "waitlist"
+                        wait_listed = True
+                        conn.execute(
+                            "UPDATE courses SET waitlist_count = waitlist_count + 1 WHERE id = ?",
+                            (course.id,),
+                        )
+                    matched.append({"course": course.name, "status": status})
+            _courses_version += 1
 
-    conn.commit()
     return {"wait_listed": wait_listed, "matched": matched}
 
 
-def _row_to_registration(row: sqlite3.Row) -> Registration:
-    return Registration(
-        id=row["id"],
-        first_name=row["first_name"],
-        last_name=row["last_name"],
-        email=row["email"],
-        phone=row["phone"],
-        grade_interest=row["grade_interest"],
-        tour_date_id=row["tour_date_id"],
-        wait_listed=bool(row["wait_listed"]),
-    )
-
-
 def create_registration(
     conn: sqlite3.Connection,
     *,
@@ -277,22 +510,87 @@ def create_registration(
     únicamente de la capacidad del tour.
     """
 
+    global _tours_version
+
     wait_listed = force_wait_listed
-    new_registered = tour_date.registered + 1
 
-    status = tour_date.status
-    conn.execute(
-        "UPDATE tour_dates SET registered = ?, status = ? WHERE id = ?",
-        (new_registered, status, tour_date.id),
-    )
-    registration_cursor = conn.execute(
-        """
-        INSERT INTO registrations(first_name, last_name, email, phone, grade_interest, tour_date_id, wait_listed)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (first_name, last_name, email, phone, grade_interest, tour_date.id, int(wait_listed)),
+    with _write_lock:
+        with conn:
+            # Increment in SQL: `tour_date` may come from the listing cache.
+            conn.execute(
+                "UPDATE tour_dates SET registered = registered + 1 WHERE id = ?",
+                (tour_date.id,),
+            )
+            registration_cursor = conn.execute(
+                """
+                INSERT INTO registrations(first_name, last_name, email, phone, grade_interest, tour_date_id, wait_listed)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (first_name, last_name, email, phone, grade_interest, tour_date.id, int(wait_listed)),
+            )
+        _tours_version += 1
+
+    registration = Registration(
+        id=registration_cursor.lastrowid,
+        first_name=first_name,
+        last_name=last_name,
+        email=email,
+        phone=phone,
+        grade_interest=grade_interest,
+        tour_date_id=tour_date.id,
+        wait_listed=wait_listed,
     )
-    conn.commit()
-    reg_id = registration_cursor.lastrowid
-    row = conn.execute("SELECT * FROM registrations WHERE id = ?", (reg_id,)).fetchone()
-    return _row_to_registration(row), wait_listed
+    return registration, wait_listed
+
+
+def load_conversation(conn: sqlite3.Connection, conv_id: str) -> Optional[sqlite3.Row]:
+    return conn.execute(
+        "SELECT version, summary, history, state, evicted FROM conversations WHERE id = ?",
+        (conv_id,),
+    ).fetchone()
+
+
+def save_conversation(
+    conn: sqlite3.Connection,
+    conv_id: str,
+    *,
+    version: int,
+    summary: str,
+    history: bytes,
+    state: bytes,
+    evicted: int,
+) -> bool:
+    """Upsert a serialized conversation so every worker process sees it.
+
+    An existing row is only overwritten when ``version`` is one past the
+    stored version; otherwise another worker saved first and nothing is
+    written. Returns whether the row was written.
+    """
+
+    global _conversation_saves
+
+    now = int(time.time())
+    with _write_lock:
+        with conn:
+            written = conn.execute(
+                """
+                INSERT INTO conversations(id, version, summary, history, state, evicted, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    version = excluded.version,
+                    summary = excluded.summary,
+                    history = excluded.history,
+                    state = excluded.state,
+                    evicted = excluded.evicted,
+                    updated_at = excluded.updated_at
+                WHERE conversations.version = excluded.version - 1
+                """,
+                (conv_id, version, summary, history, state, evicted, now),
+            ).rowcount > 0
+            _conversation_saves += 1
+            if _conversation_saves % CONVERSATION_SWEEP_EVERY == 0:
+                conn.execute(
+                    "DELETE FROM conversations WHERE updated_at < ?",
+                    (now - CONVERSATION_TTL_SECONDS,),
+                )
+    return written
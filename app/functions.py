@@ -2,7 +2,7 @@
 
 from __future__ import annotations
 from typing import Dict, Any
-from .database import create_registration, list_active_tours, reserve_course_interest
+from .database import create_registration, get_tour_by_id, reserve_course_interest
 
 # -------------------------------------------------------------------------- #
 #  FUNCTION SCHEMA optimized for minimal tokens and consistent usage
@@ -37,27 +37,23 @@ REGISTER_USER_FUNCTION = {
 def execute_register_user(db, args: Dict[str, Any]) -> Dict[str, Any]:
     """Ejecuta el registro real en SQLite."""
 
-    # Clean & normalize values
-    raw_name = args["name"].strip()
-    name_parts = raw_name.split()
-    first_name = name_parts[0]
-    last_name = " ".join(name_parts[1:]) if len(name_parts) > 1 else ""
+    # Validate tour ID before doing any other work
+    tour = get_tour_by_id(db, args["tour_date_id"])
+    if not tour:
+        return {"status": "error", "message": "tour_date_id inválido"}
+
+    # Clean & normalize values (str.split() already drops outer whitespace)
+    first_name, *last_parts = args["name"].split() or [""]
+    last_name = " ".join(last_parts)
 
     email = args["email"].strip().lower()
     phone = args["phone"].strip()
 
-    # Validate tour ID
-    tours = list_active_tours(db)
-    tour = next((t for t in tours if t.id == args["tour_date_id"]), None)
-    if not tour:
-        return {"status": "error", "message": "tour_date_id inválido"}
-
-    # Parse grades
-    grades_raw = args.get("grades", [])
-    grades_list = [
-        g.strip() for g in grades_raw
-        if isinstance(g, str) and g.strip()
-    ]
+    # Parse grades in a single pass; tolerate a comma-separated string
+    grades_raw = args.get("grades") or []
+    if isinstance(grades_raw, str):
+        grades_raw = grades_raw.split(",")
+    grades_list = [s for g in grades_raw if isinstance(g, str) and (s := g.strip())]
     grade_interest = ", ".join(grades_list) or "sin especificar"
 
     # Waitlist logic
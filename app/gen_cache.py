@@ -0,0 +1,83 @@
+# app/gen_cache.py
+"""Template cache for tourbot replies that differ only in the email given.
+
+Registration turns repeat the same structure with a different email
+("Perfecto, anoté ana@x.com ..."). On a miss the reply is stored with the
+emails masked as numbered slots; a later conversation whose history matches
+once masked gets the template rendered with its own values.
+
+Only emails are masked: any address is as valid as another, so the reply
+can't depend on which one it is. Dates, phones and grades stay in the key,
+since whether a date has a tour (or a grade has places) changes the answer.
+"""
+
+from __future__ import annotations
+import hashlib
+import re
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import orjson
+
+GEN_CACHE_SIZE = 512
+
+# Emails in user/assistant turns.
+_ENTITY_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+
+_templates: "OrderedDict[bytes, Tuple[object, str]]" = OrderedDict()
+
+
+def _mask(msgs: list, model: str) -> Tuple[bytes, List[str]]:
+    """Hash of the model and input, with conversation-turn entities replaced by slots.
+
+    System messages (prompt, tour and capacity context) are kept verbatim, so
+    a change in dates or capacity never matches an old template.
+    """
+    values: List[str] = []
+
+    def slot(match: re.Match) -> str:
+        value = match.group(0)
+        if value not in values:
+            values.append(value)
+        return f"<E{values.index(value)}>"
+
+    masked = [
+        m if m["role"] == "system" else {**m, "content": _ENTITY_RE.sub(slot, m["content"])}
+        for m in msgs
+    ]
+    return hashlib.blake2b(orjson.dumps([model, masked]), digest_size=16).digest(), values
+
+
+def lookup(msgs: list, model: str) -> Optional[object]:
+    key, values = _mask(msgs, model)
+    if not values:
+        return None  # nothing to substitute: the exact cache covers this input
+    hit = _templates.get(key)
+    if hit is None:
+        return None
+    _templates.move_to_end(key)
+
+    response, text = hit
+    for i, value in enumerate(values):
+        text = text.replace(f"<E{i}>", value)
+    rendered = response.model_copy(deep=True)
+    rendered.output[0].content[0].text = text
+    return rendered
+
+
+def store(msgs: list, model: str, response) -> None:
+    key, values = _mask(msgs, model)
+    if not values:
+        return
+
+    text = response.output[0].content[0].text
+    # Longest first so "ana@x.com" isn't split out of "juana@x.com".
+    for i, value in sorted(enumerate(values), key=lambda item: -len(item[1])):
+        text = text.replace(value, f"<E{i}>")
+    # A reply that mentions entities not taken from the history can't be reused.
+    if _ENTITY_RE.search(text):
+        return
+
+    _templates[key] = (response, text)
+    if len(_templates) > GEN_CACHE_SIZE:
+        _templates.popitem(last=False)
@@ -1,82 +1,245 @@
 
 from __future__ import annotations
 
-from uuid import uuid4
+from uuid import UUID
+from collections import OrderedDict, deque
+from itertools import islice
 from dataclasses import dataclass, field
-from typing import Dict, List, Any
-import json
-
-from fastapi import FastAPI, Depends
+from datetime import date
+from functools import lru_cache
+from typing import ClassVar, Deque, Dict, List, Optional, Tuple, Any
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import orjson
+
+from fastapi import FastAPI, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 
 from pathlib import Path
 
 from .schemas import ChatRequest, ChatResponse, InitChatResponse
-from .database import init_db, list_active_tours, list_courses, get_db_session
-from .tourbot_agent import run_tourbot
-from .state_manager import extract_state
+from .database import (
+    courses_version,
+    db_connection,
+    get_db_session,
+    init_db,
+    list_active_tours,
+    list_courses,
+    load_conversation,
+    save_conversation,
+    tours_version,
+)
+from .openai_client import close_client
+from .tourbot_agent import (
+    ESCALATION_MODEL,
+    TOURBOT_MODEL,
+    Message,
+    cache_metrics,
+    canned_reply,
+    run_tourbot,
+    stream_tourbot,
+)
+from .state_manager import extract_state, has_registration_details
 from .functions import execute_register_user
 
+logger = logging.getLogger(__name__)
+
 
 # ============================================================
 # Conversation memory
 # ============================================================
 
-@dataclass
+@dataclass(slots=True)
+class ProfileState:
+    """Registration details extracted from the turns that left the window."""
+
+    name: str = ""
+    email: str = ""
+    phone: str = ""
+    grades: List[str] = field(default_factory=list)
+    intent: str = ""
+    ready_for_registration: bool = False
+    # Set by /chat once register_user() succeeds; the extractor never sends it.
+    registered: bool = False
+
+    def merge(self, extracted: Dict[str, Any]) -> None:
+        """Keep earlier values unless the extractor found something new."""
+        for key in self.__slots__:
+            value = extracted.get(key)
+            if not value or value == "unknown":
+                continue
+            if key == "grades" and isinstance(value, str):
+                value = [g.strip() for g in value.split(",") if g.strip()]
+            setattr(self, key, value)
+
+
+@dataclass(slots=True)
 class ConversationThread:
     """Stores chat history and compressed summary for token savings."""
 
-    history: List[Dict[str, str]] = field(default_factory=list)
-    summary: str = ""
+    MAX_MESSAGES: ClassVar[int] = 10
+    # Re-extract the summary once every N messages that fall off the window.
+    SUMMARY_EVERY: ClassVar[int] = 3
 
-    MAX_MESSAGES: int = 10
-    RECENT_MESSAGES: int = 6
+    history: Deque[Message] = field(
+        default_factory=lambda: deque(maxlen=ConversationThread.MAX_MESSAGES)
+    )
+    summary: str = ""
+    # Serializes /chat turns on this thread so concurrent messages can't
+    # interleave history writes; evicted together with the conversation.
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False, compare=False)
+    _evicted: int = field(default=0, repr=False)
+    _state: ProfileState = field(default_factory=ProfileState, repr=False)
+    # Serialized _state, refreshed only when a summary pass changes it.
+    _state_json: bytes = field(default=b"{}", repr=False)
+    # Version of the row last loaded from / saved to the conversations table.
+    version: int = field(default=0, repr=False)
+    # Background summary refresh; kept referenced so it isn't collected.
+    _summary_task: Optional[asyncio.Task] = field(default=None, repr=False, compare=False)
+    # Key of the conversations row, so the summary refresh can save itself.
+    conv_id: str = field(default="", repr=False)
 
     def append(self, role: str, content: str) -> None:
-        self.history.append({"role": role, "content": content})
-        self._trim()
+        # The deque drops the oldest message by itself; grab the messages that
+        # are about to leave and refresh the summary from them in the
+        # background, so the turn never waits on the extractor. Until it
+        # finishes, prompts use the previous summary.
+        if len(self.history) == self.MAX_MESSAGES:
+            if self._evicted % self.SUMMARY_EVERY == 0:
+                leaving = list(islice(self.history, self.SUMMARY_EVERY))
+                self._summary_task = asyncio.create_task(
+                    self._summarize(leaving, self._summary_task)
+                )
+            self._evicted += 1
+        self.history.append(Message(role, content))
+
+    async def _summarize(self, leaving: List[Message], previous: Optional[asyncio.Task]) -> None:
+        # Only the oldest SUMMARY_EVERY messages are about to leave the window
+        # (the rest is still sent verbatim), so extract just those and merge
+        # them into the running state instead of re-reading the whole history.
+        # Refreshes are applied in order.
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        extracted = await extract_state(leaving)
+
+        # The turn that started this refresh has usually been saved already,
+        # with the shortened history and _evicted advanced. Apply the result
+        # under the thread lock and save again, so the stored row never keeps
+        # a window without the summary of the messages that left it.
+        async with self.lock:
+            with db_connection() as db:
+                load_conversation_state(db, self.conv_id, self)
+                state = self._state
+                state.merge(extracted)
+                self._state_json = orjson.dumps(state)
+
+                # Build short snapshot
+                snapshot = (
+                    f"Nombre: {state.name or '-'}, "
+                    f"Email: {state.email or '-'}, "
+                    f"Teléfono: {state.phone or '-'}, "
+                    f"Grados: {', '.join(state.grades) or '-'}, "
+                    f"Intención: {state.intent or '-'}, "
+                    f"Listo: {'sí' if state.ready_for_registration else 'no'}"
+                )
 
-    def _trim(self) -> None:
-        # If history exceeds threshold, compress it using semantic extraction
-        if len(self.history) <= self.MAX_MESSAGES:
-            return
+                # Overwrite summary (do NOT accumulate)
+                self.summary = snapshot
+                await save_conversation_state(db, self.conv_id, self)
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "summary": self.summary,
+            "history": orjson.dumps([tuple(m) for m in self.history]),
+            "state": self._state_json,
+            "evicted": self._evicted,
+        }
 
-        # Only extract state every 3 messages to reduce token usage
-        if len(self.history) % 3 == 0:
-            state = extract_state(self.history)
+    def restore(self, row) -> None:
+        self.history.clear()
+        self.history.extend(Message(*m) for m in orjson.loads(row["history"]))
+        self.summary = row["summary"]
+        self._state_json = row["state"]
+        self._state = ProfileState()
+        self._state.merge(orjson.loads(self._state_json))
+        self._evicted = row["evicted"]
+        self.version = row["version"]
+
+
+MAX_CONVERSATIONS = 10_000
+
+# LRU of live conversations; the least recently used thread is evicted once
+# MAX_CONVERSATIONS is exceeded so memory stays bounded.
+conversations: "OrderedDict[str, ConversationThread]" = OrderedDict()
+_conversations_lock = threading.Lock()
+
+
+def new_conversation_id() -> str:
+    """UUIDv7 (RFC 9562): time-ordered, so new rows land at the right edge of
+    the conversations primary-key index instead of on random pages. The id
+    stays opaque to clients."""
+    ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (ms & (1 << 48) - 1) << 80
+        | 0x7 << 76
+        | (rand >> 68) << 64
+        | 0b10 << 62
+        | rand & (1 << 62) - 1
+    )
+    return str(UUID(int=value))
+
+
+def get_conversation(conv_id: str) -> ConversationThread:
+    with _conversations_lock:
+        conversation = conversations.get(conv_id)
+        if conversation is None:
+            conversation = ConversationThread(conv_id=conv_id)
+            conversations[conv_id] = conversation
         else:
-            state = {}
-
-        # Build short snapshot
-        grades = state.get("grades") or []
-        if isinstance(grades, str):
-            grades = [g.strip() for g in grades.split(",") if g.strip()]
-
-        snapshot = (
-            f"Nombre: {state.get('name') or '-'}, "
-            f"Email: {state.get('email') or '-'}, "
-            f"Teléfono: {state.get('phone') or '-'}, "
-            f"Grados: {', '.join(grades) or '-'}, "
-            f"Intención: {state.get('intent') or '-'}, "
-            f"Listo: {'sí' if state.get('ready_for_registration') else 'no'}"
-        )
+            conversations.move_to_end(conv_id)
+        if len(conversations) > MAX_CONVERSATIONS:
+            conversations.popitem(last=False)
+        return conversation
 
-        # Overwrite summary (do NOT accumulate)
-        self.summary = snapshot
 
-        # Keep only last few messages
-        self.history = self.history[-self.RECENT_MESSAGES:]
+# The in-process LRU only saves re-parsing: the conversations table is the
+# source of truth, so a conversation can move between worker processes.
+def load_conversation_state(db, conv_id: str, conversation: ConversationThread) -> None:
+    row = load_conversation(db, conv_id)
+    if row is not None and row["version"] != conversation.version:
+        conversation.restore(row)
 
 
-conversations: Dict[str, ConversationThread] = {}
+async def save_conversation_state(db, conv_id: str, conversation: ConversationThread) -> None:
+    conversation.version += 1
+    saved = await run_in_threadpool(save_conversation, db, conv_id, **conversation.to_record())
+    if not saved:
+        # Another worker saved this conversation first (a retried or double
+        # submitted message). Its row wins; reload it so this copy doesn't
+        # keep diverging from the stored one.
+        logger.warning("Conversation %s was saved concurrently; reloading", conv_id)
+        row = load_conversation(db, conv_id)
+        if row is not None:
+            conversation.restore(row)
 
 
 # ============================================================
 # FastAPI setup
 # ============================================================
 
+# The default response class is kept on purpose: for routes with a
+# response_model FastAPI serializes straight to JSON bytes via pydantic-core,
+# and a custom class (e.g. ORJSONResponse) would turn that fast path off.
 app = FastAPI(title="SAM - Montebello TourBot", version="3.0")
 
 app.add_middleware(
@@ -91,51 +254,114 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 INDEX_FILE = Path("app/templates/index.html")
 THANK_YOU_FILE = Path("app/templates/thank_you.html")
 
+# Static pages are read once at import and served from memory as raw bytes.
+# Set RELOAD_TEMPLATES=1 during development to re-read them on every request.
+RELOAD_TEMPLATES = os.getenv("RELOAD_TEMPLATES") == "1"
+INDEX_HTML = INDEX_FILE.read_bytes()
+THANK_YOU_HTML = THANK_YOU_FILE.read_bytes()
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+INDEX_ETAG = _etag(INDEX_HTML)
+THANK_YOU_ETAG = _etag(THANK_YOU_HTML)
+
+
+def _html_page(request: Request, body: bytes, etag: str) -> Response:
+    # Browsers revalidate with If-None-Match; answer 304 when nothing changed.
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
+
 
 @app.on_event("startup")
 def startup_event():
     init_db()
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_client()
+
+
 # ============================================================
 # JSON-based context builders (compact, token-saving)
 # ============================================================
 
-def build_tour_context_json(db) -> Dict[str, Any]:
-    tours = list_active_tours(db)
-    return {
-        "tour_dates": [
-            {
-                "index": i + 1,
-                "date": t.date.strftime("%Y-%m-%d"),
-                "display": t.date.strftime("%d/%m/%Y"),
-                "id": t.id,
-            }
-            for i, t in enumerate(tours)
-        ]
-    }
-
-
-def build_capacity_json(db) -> Dict[str, Any]:
-    courses = list_courses(db)
-    return {
-        "capacity": {
-            course.name: (
-                course.capacity_available
-                if course.capacity_available > 0
-                else 0
-            )
-            for course in courses
-        }
-    }
+# Derived tour views, memoized on the (id, date) of each active tour so that
+# registrations, which only move counters, don't re-run strftime. The returned
+# objects are shared between requests and must not be mutated.
+@lru_cache(maxsize=16)
+def _format_tour_views(
+    fingerprint: Tuple[Tuple[int, date], ...]
+) -> Tuple[Dict[str, Any], List[str]]:
+    return (
+        {
+            "tour_dates": [
+                {
+                    "index": i + 1,
+                    "date": day.strftime("%Y-%m-%d"),
+                    "display": day.strftime("%d/%m/%Y"),
+                    "id": tour_id,
+                }
+                for i, (tour_id, day) in enumerate(fingerprint)
+            ]
+        },
+        [
+            f"{i+1}. {day.strftime('%d/%m/%Y')} · Cupo abierto"
+            for i, (_, day) in enumerate(fingerprint)
+        ],
+    )
+
+
+def _tour_fingerprint(db) -> Tuple[Tuple[int, date], ...]:
+    return tuple((t.id, t.date) for t in list_active_tours(db))
+
+
+def _capacity_fingerprint(db) -> Tuple[Tuple[str, int], ...]:
+    return tuple(
+        (course.name, max(course.capacity_available, 0)) for course in list_courses(db)
+    )
+
+
+def _tour_views(db) -> Tuple[Dict[str, Any], List[str]]:
+    return _format_tour_views(_tour_fingerprint(db))
 
 
 def build_tour_suggestions(db) -> List[str]:
-    tours = list_active_tours(db)
-    return [
-        f"{i+1}. {t.date.strftime('%d/%m/%Y')} · Cupo abierto"
-        for i, t in enumerate(tours)
-    ]
+    return _tour_views(db)[1]
+
+
+# The serialized context strings are memoized on their content, so version
+# bumps that leave the data unchanged (a TTL refresh, a registration) hand
+# back the very same str objects instead of re-encoding them.
+@lru_cache(maxsize=16)
+def _tour_context_str(fingerprint: Tuple[Tuple[int, date], ...]) -> str:
+    return orjson.dumps(_format_tour_views(fingerprint)[0]).decode()
+
+
+@lru_cache(maxsize=16)
+def _capacity_str(fingerprint: Tuple[Tuple[str, int], ...]) -> str:
+    return orjson.dumps({"capacity": dict(fingerprint)}).decode()
+
+
+# Serialized LLM context, rebuilt when the data versions move (local writes,
+# or the listing TTL in the database layer picking up other workers' writes).
+_context_cache: Dict[str, Any] = {"versions": None, "value": ("", "")}
+
+
+def get_llm_context(db) -> Tuple[str, str]:
+    versions = (tours_version(), courses_version())
+    if _context_cache["versions"] != versions:
+        _context_cache["value"] = (
+            _tour_context_str(_tour_fingerprint(db)),
+            _capacity_str(_capacity_fingerprint(db)),
+        )
+        _context_cache["versions"] = versions
+    return _context_cache["value"]
 
 
 # ============================================================
@@ -143,13 +369,30 @@ def build_tour_suggestions(db) -> List[str]:
 # ============================================================
 
 @app.get("/", response_class=HTMLResponse)
-def home():
-    return HTMLResponse(INDEX_FILE.read_text(encoding="utf-8"))
+async def home(request: Request):
+    if RELOAD_TEMPLATES:
+        body = INDEX_FILE.read_bytes()
+        return _html_page(request, body, _etag(body))
+    return _html_page(request, INDEX_HTML, INDEX_ETAG)
 
 
 @app.get("/gracias", response_class=HTMLResponse)
-def thank_you():
-    return HTMLResponse(THANK_YOU_FILE.read_text(encoding="utf-8"))
+async def thank_you(request: Request):
+    if RELOAD_TEMPLATES:
+        body = THANK_YOU_FILE.read_bytes()
+        return _html_page(request, body, _etag(body))
+    return _html_page(request, THANK_YOU_HTML, THANK_YOU_ETAG)
+
+
+# ============================================================
+# Metrics
+# ============================================================
+
+@app.get("/metrics.json")
+async def metrics():
+    """Cache counters and hit ratios as JSON. Not the Prometheus text format,
+    hence the .json suffix, so a scraper pointed at /metrics fails loudly."""
+    return cache_metrics()
 
 
 # ============================================================
@@ -157,10 +400,10 @@ def thank_you():
 # ============================================================
 
 @app.get("/chat/init", response_model=InitChatResponse)
-def init_chat(db=Depends(get_db_session)):
-    conv_id = str(uuid4())
+async def init_chat(db=Depends(get_db_session)):
+    conv_id = new_conversation_id()
 
-    conversations[conv_id] = ConversationThread()
+    conversation = get_conversation(conv_id)
 
     intro = (
         "Hola 👋 soy SAM, tu asistente de Admisiones del Montebello. "
@@ -169,7 +412,8 @@ def init_chat(db=Depends(get_db_session)):
     )
 
     suggestions = build_tour_suggestions(db)
-    conversations[conv_id].append("assistant", intro)
+    conversation.append("assistant", intro)
+    await save_conversation_state(db, conv_id, conversation)
 
     return InitChatResponse(
         conversation_id=conv_id,
@@ -183,30 +427,106 @@ def init_chat(db=Depends(get_db_session)):
 # Chat endpoint
 # ============================================================
 
-@app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest, db=Depends(get_db_session)):
-    conv_id = req.conversation_id or str(uuid4())
-    conversation = conversations.setdefault(conv_id, ConversationThread())
-
-    # Append user message
-    conversation.append("user", req.message)
-
-    # Build compact JSON context
-    tour_context = build_tour_context_json(db)
-    capacity_context = build_capacity_json(db)
-
-    # Call LLM
-    raw = run_tourbot(
-        conversation.history,
-        conversation.summary,
-        json.dumps(tour_context),
-        json.dumps(capacity_context),
+REPLY_JSON_ERROR = (
+    "Creo que hubo un problema con los datos. "
+    "¿Me confirmas nuevamente la fecha que deseas?"
+)
+REPLY_DATE_MISSING = "Necesito confirmar la fecha exacta del tour. ¿Cuál deseas?"
+REPLY_REGISTER_FAIL = (
+    "No logré completar el registro. "
+    "¿Podrías confirmarme nuevamente tus datos?"
+)
+REPLY_REGISTER_OK = (
+    "¡Listo! 🙌 Tu registro al tour fue procesado con éxito. "
+    "En breve recibirás la confirmación por correo."
+)
+REPLY_NO_ANSWER = (
+    "Tuve un problema al generar la respuesta. "
+    "¿Podrías repetirme tu mensaje?"
+)
+
+
+async def _chat_reply(
+    conversation: ConversationThread,
+    db,
+    conv_id: str,
+    reply: str,
+    *,
+    stage: str = "chat",
+    done: bool = False,
+    wait: bool = False,
+) -> ChatResponse:
+    """Record the assistant reply and build the response for this turn."""
+    conversation.append("assistant", reply)
+    return ChatResponse(
+        conversation_id=conv_id,
+        reply=reply,
+        stage=stage,
+        registration_completed=done,
+        wait_listed=wait,
+        suggested_tours=build_tour_suggestions(db),
     )
-    output = raw.output[0]
 
-    suggestions = build_tour_suggestions(db)
 
+@app.post("/chat", response_model=ChatResponse)
+async def chat(req: ChatRequest):
+    conv_id = req.conversation_id or new_conversation_id()
+    conversation = get_conversation(conv_id)
+
+    # LLM calls are awaited on the loop (the summary refresh append() may start
+    # runs as a background task); SQLite writes go to the threadpool. A pooled
+    # connection is borrowed before and after the LLM call, never across it.
+    async with conversation.lock:
+        with db_connection() as db:
+            load_conversation_state(db, conv_id, conversation)
+            conversation.append("user", req.message)
+            canned = canned_reply(req.message)
+            if canned is not None:
+                response = await _chat_reply(conversation, db, conv_id, canned)
+                await save_conversation_state(db, conv_id, conversation)
+                return response
+
+            # Compact JSON context, cached across requests
+            tour_json, capacity_json = get_llm_context(db)
+
+        # Call LLM
+        raw = await run_tourbot(
+            conversation.history,
+            conversation.summary,
+            tour_json,
+            capacity_json,
+            model=_tourbot_model(conversation),
+        )
 
+        with db_connection() as db:
+            response = await _respond(raw.output[0], db, conv_id, conversation)
+            if response is None:
+                # Neither text nor a known tool call (e.g. a hallucinated
+                # function name): answer with a retry prompt, not a 500.
+                response = await _chat_reply(conversation, db, conv_id, REPLY_NO_ANSWER)
+            await save_conversation_state(db, conv_id, conversation)
+        return response
+
+
+def _tourbot_model(conversation: ConversationThread) -> str:
+    # Escalate only while a registration is pending, i.e. on the few turns
+    # between the details coming in and register_user() succeeding; the rest
+    # is chit-chat. Details given before the last completed registration
+    # don't count, so later questions go back to the cheap model.
+    state = conversation._state
+    history = list(conversation.history)
+    for i in range(len(history) - 1, -1, -1):
+        if history[i].content == REPLY_REGISTER_OK:
+            history = history[i + 1:]
+            break
+    if (state.ready_for_registration and not state.registered) or has_registration_details(
+        history
+    ):
+        return ESCALATION_MODEL
+    return TOURBOT_MODEL
+
+
+async def _respond(output, db, conv_id: str, conversation: ConversationThread):
     # ============================================================
     # FUNCTION CALL HANDLING
     # ============================================================
@@ -215,67 +535,31 @@ def chat(req: ChatRequest, db=Depends(get_db_session)):
 
         # Safe JSON parsing
         try:
-            args = json.loads(output.arguments)
+            args = orjson.loads(output.arguments)
         except Exception:
-            reply = (
-                "Creo que hubo un problema con los datos. "
-                "¿Me confirmas nuevamente la fecha que deseas?"
-            )
-            conversation.append("assistant", reply)
-            return ChatResponse(
-                conversation_id=conv_id,
-                reply=reply,
-                stage="chat",
-                registration_completed=False,
-                wait_listed=False,
-                suggested_tours=suggestions,
-            )
+            return await _chat_reply(conversation, db, conv_id, REPLY_JSON_ERROR)
 
         if fn_name == "register_user":
 
             # Validate required fields before executing
             if not isinstance(args.get("tour_date_id"), int):
-                reply = "Necesito confirmar la fecha exacta del tour. ¿Cuál deseas?"
-                conversation.append("assistant", reply)
-                return ChatResponse(
-                    conversation_id=conv_id,
-                    reply=reply,
-                    stage="chat",
-                    registration_completed=False,
-                    wait_listed=False,
-                    suggested_tours=suggestions,
-                )
+                return await _chat_reply(conversation, db, conv_id, REPLY_DATE_MISSING)
 
-            result = execute_register_user(db, args)
+            result = await run_in_threadpool(execute_register_user, db, args)
 
             if result.get("status") != "success":
-                reply = (
-                    "No logré completar el registro. "
-                    "¿Podrías confirmarme nuevamente tus datos?"
-                )
-                conversation.append("assistant", reply)
-                return ChatResponse(
-                    conversation_id=conv_id,
-                    reply=reply,
-                    stage="chat",
-                    registration_completed=False,
-                    wait_listed=False,
-                    suggested_tours=suggestions,
-                )
-
-            reply = (
-                "¡Listo! 🙌 Tu registro al tour fue procesado con éxito. "
-                "En breve recibirás la confirmación por correo."
-            )
-            conversation.append("assistant", reply)
-
-            return ChatResponse(
-                conversation_id=conv_id,
-                reply=reply,
+                return await _chat_reply(conversation, db, conv_id, REPLY_REGISTER_FAIL)
+
+            conversation._state.registered = True
+            conversation._state_json = orjson.dumps(conversation._state)
+            return await _chat_reply(
+                conversation,
+                db,
+                conv_id,
+                REPLY_REGISTER_OK,
                 stage="completed",
-                registration_completed=True,
-                wait_listed=result.get("wait_listed", False),
-                suggested_tours=suggestions,
+                done=True,
+                wait=result.get("wait_listed", False),
             )
 
 
@@ -283,14 +567,78 @@ def chat(req: ChatRequest, db=Depends(get_db_session)):
     # NORMAL TEXT MESSAGE
     # ============================================================
     if output.type == "message":
-        reply = output.content[0].text
-        conversation.append("assistant", reply)
-
-        return ChatResponse(
-            conversation_id=conv_id,
-            reply=reply,
-            stage="chat",
-            registration_completed=False,
-            wait_listed=False,
-            suggested_tours=suggestions,
-        )
+        return await _chat_reply(conversation, db, conv_id, output.content[0].text)
+
+
+# ============================================================
+# Streaming chat endpoint (Server-Sent Events)
+# ============================================================
+
+_STREAM_END_EVENTS = ("response.completed", "response.incomplete", "response.failed")
+
+
+def _sse(data: bytes) -> bytes:
+    return b"data: " + data + b"\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    Same turn as /chat, streamed: one {"delta": ...} event per text chunk
+    while the model writes, then a final event with the ChatResponse payload.
+    """
+    conv_id = req.conversation_id or new_conversation_id()
+    conversation = get_conversation(conv_id)
+    return StreamingResponse(
+        _chat_stream_events(req, conv_id, conversation),
+        media_type="text/event-stream",
+    )
+
+
+async def _chat_stream_events(req: ChatRequest, conv_id: str, conversation: ConversationThread):
+    async with conversation.lock:
+        with db_connection() as db:
+            load_conversation_state(db, conv_id, conversation)
+            conversation.append("user", req.message)
+            canned = canned_reply(req.message)
+            if canned is not None:
+                response = await _chat_reply(conversation, db, conv_id, canned)
+                await save_conversation_state(db, conv_id, conversation)
+            else:
+                response = None
+                tour_json, capacity_json = get_llm_context(db)
+        if response is not None:
+            yield _sse(response.model_dump_json().encode())
+            return
+
+        # A reply cut at max_output_tokens ends with response.incomplete and
+        # is returned truncated, as /chat does. Whatever happens, including a
+        # failure to open the stream, the turn is saved and closed with a
+        # final ChatResponse event.
+        raw = None
+        try:
+            stream = await stream_tourbot(
+                conversation.history,
+                conversation.summary,
+                tour_json,
+                capacity_json,
+                model=_tourbot_model(conversation),
+            )
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield _sse(orjson.dumps({"delta": event.delta}))
+                elif event.type in _STREAM_END_EVENTS:
+                    raw = event.response
+                elif event.type == "error":
+                    logger.warning("Tourbot stream error: %s", event.message)
+        except Exception as e:
+            logger.warning("Tourbot stream failed: %s", e)
+
+        with db_connection() as db:
+            response = None
+            if raw is not None and raw.output:
+                response = await _respond(raw.output[0], db, conv_id, conversation)
+            if response is None:
+                response = await _chat_reply(conversation, db, conv_id, REPLY_NO_ANSWER)
+            await save_conversation_state(db, conv_id, conversation)
+        yield _sse(response.model_dump_json().encode())
@@ -2,34 +2,54 @@
 
 
 from __future__ import annotations
+import logging
 import os
 from typing import Optional
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, Timeout
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # ---------------------------------------------------
 # GLOBAL CLIENT
 # ---------------------------------------------------
+# One async client per process: calls are awaited on the event loop instead of
+# holding a worker thread, and its HTTP connection pool keeps TLS sessions to
+# the API alive between requests. The SDK's default read timeout is 10
+# minutes, far longer than any chat turn should be allowed to hang.
+# The SDK retries 429s, 5xx and connection errors with jittered exponential
+# backoff (honouring Retry-After); two retries is too few for a burst of
+# rate limits, so allow four.
 _API_KEY = os.getenv("OPENAI_API_KEY")
-_client: OpenAI = OpenAI(api_key=_API_KEY) if _API_KEY else None
+_TIMEOUT = Timeout(30.0, connect=5.0)
+_MAX_RETRIES = 4
+_client: Optional[AsyncOpenAI] = (
+    AsyncOpenAI(api_key=_API_KEY, timeout=_TIMEOUT, max_retries=_MAX_RETRIES)
+    if _API_KEY
+    else None
+)
+
+
+async def close_client() -> None:
+    """Close the pooled HTTP connections on shutdown."""
+    if _client is not None:
+        await _client.close()
 
 # ---------------------------------------------------
 # POLISHER (minimal prompt to reduce token usage)
 # ---------------------------------------------------
 POLISH_PROMPT = "Reescribe el texto con tono cálido y profesional, sin agregar información nueva."
 
-DEBUG_POLISH = True   
-
 
-def polish_reply(draft: str) -> str:
+async def polish_reply(draft: str) -> str:
     """Rewrite a message in a warm, concise tone."""
     if not draft.strip() or not _client:
         return draft
 
     try:
-        completion = _client.responses.create(
+        completion = await _client.responses.create(
             model="gpt-4o-mini",
             input=[
                 {"role": "system", "content": POLISH_PROMPT},
@@ -39,13 +59,14 @@ def polish_reply(draft: str) -> str:
             max_output_tokens=80
         )
 
-        if DEBUG_POLISH:
+        if logger.isEnabledFor(logging.DEBUG):
             usage = completion.usage
-            print("\n[polish_reply] TOKENS:")
-            print(f"  Input tokens p:   {usage.input_tokens}")
-            print(f"  Output tokens p:  {usage.output_tokens}")
-            print(f"  Total tokens p:   {usage.total_tokens}")
-            print("-" * 40)
+            logger.debug(
+                "polish tokens in=%d out=%d total=%d",
+                usage.input_tokens,
+                usage.output_tokens,
+                usage.total_tokens,
+            )
 
         return completion.output_text or draft
 
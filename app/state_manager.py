@@ -2,8 +2,20 @@
 
 
 from __future__ import annotations
+import logging
+import re
 from typing import List, Dict, Any
+
+import orjson
+
 from .openai_client import _client
+from .tourbot_agent import Message
+
+logger = logging.getLogger(__name__)
+
+# The extractor only fills a fixed schema from a few turns; the smallest
+# model that supports structured outputs is enough.
+EXTRACTION_MODEL = "gpt-4.1-nano"
 
 EXTRACTION_PROMPT = """
 Extrae del diálogo solo los datos mencionados.
@@ -26,29 +38,110 @@ Reglas:
 - Si algún dato no aparece, déjalo vacío.
 """
 
-def extract_state(history: List[Dict[str, str]]) -> Dict[str, Any]:
+# Structured outputs: the model can only emit this shape, so the parsed dict
+# always has every field with the right type.
+_STATE_FORMAT = {
+    "type": "json_schema",
+    "name": "profile_state",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string"},
+            "email": {"type": "string"},
+            "phone": {"type": "string"},
+            "grades": {"type": "array", "items": {"type": "string"}},
+            "intent": {"type": "string", "enum": ["unknown", "info", "question", "register"]},
+            "ready_for_registration": {"type": "boolean"},
+        },
+        "required": ["name", "email", "phone", "grades", "intent", "ready_for_registration"],
+        "additionalProperties": False,
+    },
+}
+
+# User turns that cannot carry a name, email, phone or grade: greetings,
+# yes/no and thanks. (No length rule: a bare first name is short too.)
+_TRIVIAL_RE = re.compile(
+    r"^\W*((hola|s[ií]|no|ok(ay)?|vale|dale|claro|gracias|muchas gracias|"
+    r"buen[oa]s?( d[ií]as| tardes| noches)?)\W*)?$",
+    re.IGNORECASE,
+)
+
+# Deterministic fields, read locally before (or instead of) the LLM call.
+_EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+# Ecuadorian mobile numbers: 09XXXXXXXX or +593 9XXXXXXXX, spaces/dashes allowed.
+_PHONE_RE = re.compile(r"(?:\+?593[\s-]?|0)9(?:[\s-]?\d){8}")
+# Course names are "Inicial" and "1° EGB" … "6° EGB"; accept "2do de básica" etc.
+_GRADE_RE = re.compile(
+    r"\b(inicial\b|([1-6])\s*(?:[°º]|ro|do|er|to|mo|vo)?\s*(?:de\s+)?(?:egb|b[aá]sica)\b)",
+    re.IGNORECASE,
+)
+
+
+def _empty_state() -> Dict[str, Any]:
+    return {
+        "name": "",
+        "email": "",
+        "phone": "",
+        "grades": [],
+        "intent": "unknown",
+        "ready_for_registration": False,
+    }
+
+
+def _is_trivial(text: str) -> bool:
+    return _TRIVIAL_RE.match(text) is not None
+
+
+def _scan(history: List[Message]) -> tuple[Dict[str, Any], bool]:
+    """Pull email/phone/grades out of the user turns with the patterns above.
+
+    Also reports whether that accounts for everything the user said, i.e.
+    each turn is trivial once the matched fields are cut out.
+    """
+    found: Dict[str, Any] = {"email": "", "phone": "", "grades": []}
+    covered = True
+    for role, content in history:
+        if role != "user":
+            continue
+        for match in _EMAIL_RE.finditer(content):
+            found["email"] = match.group(0).lower()
+        for match in _PHONE_RE.finditer(content):
+            found["phone"] = re.sub(r"[\s-]", "", match.group(0))
+        for match in _GRADE_RE.finditer(content):
+            grade = f"{match.group(2)}° EGB" if match.group(2) else "Inicial"
+            if grade not in found["grades"]:
+                found["grades"].append(grade)
+        rest = _GRADE_RE.sub(" ", _PHONE_RE.sub(" ", _EMAIL_RE.sub(" ", content)))
+        covered = covered and _is_trivial(rest)
+    return found, covered
+
+
+def has_registration_details(history: List[Message]) -> bool:
+    """True once an email, a phone and at least one grade appear in the user turns."""
+    found, _ = _scan(history)
+    return all(found.values())
+
+
+async def extract_state(history: List[Message]) -> Dict[str, Any]:
     """
     Performs semantic extraction using a small JSON-only model.
     Only the last few user/assistant turns are sent to reduce token usage.
     """
 
-    # No client (offline mode)
-    if not _client:
-        return {
-            "name": "",
-            "email": "",
-            "phone": "",
-            "grades": [],
-            "intent": "unknown",
-            "ready_for_registration": False,
-        }
-
     # Keep only last 4 messages
     slim_history = history[-4:]
 
+    # Email/phone/grades come from local patterns. If they (plus greetings
+    # and yes/no) explain every user turn, or there is no client (offline
+    # mode), skip the round-trip.
+    local, covered = _scan(slim_history)
+    if covered or not _client:
+        return {**_empty_state(), **local}
+
     # Convert to minimal text for lower token usage
     dialogue_text = "\n".join(
-        f"{m['role'][0].upper()}: {m['content']}" for m in slim_history
+        f"{role[0].upper()}: {content}" for role, content in slim_history
     )
 
     messages = [
@@ -57,23 +150,20 @@ def extract_state(history: List[Dict[str, str]]) -> Dict[str, Any]:
     ]
 
     try:
-        completion = _client.responses.create(
-            model="gpt-4o-mini",
-            input=messages,                          
-            response_format={"type": "json_object"},  
+        completion = await _client.responses.create(
+            model=EXTRACTION_MODEL,
+            input=messages,
+            text={"format": _STATE_FORMAT},
             temperature=0,
             max_output_tokens=120,
         )
 
-        return completion.output[0].content[0].json
+        # Responses output items carry plain text; decode the JSON ourselves.
+        state = orjson.loads(completion.output_text)
+        # The patterns are exact; prefer them over the model's reading.
+        state.update({key: value for key, value in local.items() if value})
+        return state
 
     except Exception as e:
-        print("State extraction failed:", e)
-        return {
-            "name": "",
-            "email": "",
-            "phone": "",
-            "grades": [],
-            "intent": "unknown",
-            "ready_for_registration": False,
-        }
+        logger.warning("State extraction failed: %s", e)
+        return {**_empty_state(), **local}
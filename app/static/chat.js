@@ -19,6 +19,7 @@ const addMessage = (text, sender = 'bot') => {
     bubble.innerText = text;
     chatBox.appendChild(bubble);
     scrollToBottom();
+    return bubble;
 };
 
 const toggleTyping = (show) => {
@@ -46,6 +47,24 @@ const requestWithRetry = async (url, options = {}, attempts = 2) => {
     throw lastError;
 };
 
+// Reads the /chat/stream body and hands each "data: {...}" event to onEvent.
+const readEvents = async (res, onEvent) => {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const chunk = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            if (chunk.startsWith('data: ')) onEvent(JSON.parse(chunk.slice(6)));
+        }
+    }
+};
+
 const initializeChat = async ({ silent = false } = {}) => {
     try {
         setConnectionBanner('Conectando con SAM…', 'ok');
@@ -77,7 +96,7 @@ const sendMessage = async () => {
 
     try {
         const res = await requestWithRetry(
-            '/chat',
+            '/chat/stream',
             {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
@@ -91,11 +110,31 @@ const sendMessage = async () => {
 
         if (!res.ok) throw new Error('Error al contactar el servidor');
 
-        const data = await res.json();
+        // Text is shown as it is generated; the last event is the full
+        // ChatResponse, whose reply replaces the streamed draft.
+        let bubble = null;
+        let data = null;
+        await readEvents(res, (event) => {
+            if (!('delta' in event)) {
+                data = event;
+            } else if (!bubble) {
+                toggleTyping(false);
+                bubble = addMessage(event.delta, 'bot');
+            } else {
+                bubble.innerText += event.delta;
+                scrollToBottom();
+            }
+        });
+        if (!data) throw new Error('Respuesta incompleta del servidor');
+
         conversationId = data.conversation_id;
         sessionStorage.setItem('sam-conversation-id', conversationId);
 
-        addMessage(data.reply, 'bot');
+        if (bubble) {
+            bubble.innerText = data.reply;
+        } else {
+            addMessage(data.reply, 'bot');
+        }
 
         if (data.registration_completed) {
             setTimeout(() => {
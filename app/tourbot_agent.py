@@ -1,9 +1,29 @@
 # app/tourbot_agent.py
 from __future__ import annotations
-from typing import List, Dict
+import hashlib
+import logging
+import math
+import operator
+import re
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Optional
+
+import orjson
+
+from . import gen_cache
 from .openai_client import _client
 from .functions import REGISTER_USER_FUNCTION
 
+logger = logging.getLogger(__name__)
+
+
+class Message(NamedTuple):
+    """Un turno del historial; la tupla ocupa mucho menos que un dict."""
+
+    role: str
+    content: str
+
 
 SYSTEM_PROMPT = """
 Eres SAM, asistente de Admisiones del Montebello. Responde con tono cálido,
@@ -52,8 +72,65 @@ usuario al registro del Tour Informativo.
 
 
 
+# Compartido entre llamadas; no se modifica.
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+
+# Tope del historial enviado, en caracteres (~4 por token, unos 2000 tokens).
+# El deque de la conversación ya limita el número de mensajes; esto acota
+# también su tamaño cuando alguien pega textos largos.
+HISTORY_CHAR_BUDGET = 8000
+
+
+def _trim_history(history: Iterable[Message], budget: int = HISTORY_CHAR_BUDGET) -> List[Message]:
+    """Los mensajes más recientes que caben en el presupuesto (al menos el último)."""
+    kept: List[Message] = []
+    for message in reversed(list(history)):
+        budget -= len(message.content)
+        if budget < 0 and kept:
+            break
+        kept.append(message)
+    kept.reverse()
+    return kept
+
+
+def _coalesce(history: Iterable[Message]) -> List[Message]:
+    """Une mensajes seguidos del mismo rol y quita los vacíos.
+
+    Pasa, por ejemplo, cuando falla la llamada al modelo: el mensaje del
+    usuario queda en el historial sin respuesta y el siguiente va detrás.
+    """
+    merged: List[Message] = []
+    for message in history:
+        if not message.content:
+            continue
+        if merged and merged[-1].role == message.role:
+            merged[-1] = Message(message.role, merged[-1].content + "\n" + message.content)
+        else:
+            merged.append(message)
+    return merged
+
+
+# El mensaje de contexto se memoiza: entre turnos casi nunca cambia, así que
+# se reutiliza en vez de reconstruirse. El dict devuelto se comparte; no
+# modificarlo.
+@lru_cache(maxsize=64)
+def _dynamic_message(
+    tour_options_text: str | None, course_capacity_text: str | None, summary: str | None
+) -> Optional[dict]:
+    dynamic = [text for text in (tour_options_text, course_capacity_text) if text]
+    if summary:
+        dynamic.append(
+            "Resumen comprimido de la conversación previa (no repitas literalmente): "
+            + summary
+        )
+    if not dynamic:
+        return None
+    return {"role": "system", "content": "\n".join(dynamic)}
+
+
 def build_messages(
-    history: List[Dict[str, str]],
+    history: Iterable[Message],
     summary: str | None = None,
     tour_options_text: str | None = None,
     course_capacity_text: str | None = None,
@@ -62,31 +139,267 @@ def build_messages(
     Construye el input estructurado para la API moderna de OpenAI.
     Recibe el historial reciente y un resumen breve de turnos previos
     para minimizar tokens en cada solicitud.
+
+    El prompt fijo va siempre primero y es idéntico byte a byte, así el
+    caché automático de prompts de OpenAI reutiliza ese prefijo. Todo lo
+    variable (fechas, cupos, resumen) va en un único mensaje de sistema
+    después, seguido del historial, recortado a HISTORY_CHAR_BUDGET y sin
+    mensajes seguidos del mismo rol.
     """
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-    if tour_options_text:
-        messages.append({"role": "system", "content": tour_options_text})
-    if course_capacity_text:
-        messages.append({"role": "system", "content": course_capacity_text})
-    if summary:
-        messages.append(
-            {
-                "role": "system",
-                "content": (
-                    "Resumen comprimido de la conversación previa (no repitas literalmente): "
-                    + summary
-                ),
-            }
-        )
-    messages.extend(history)
+    messages = [_SYSTEM_MESSAGE]
+    dynamic = _dynamic_message(tour_options_text, course_capacity_text, summary)
+    if dynamic is not None:
+        messages.append(dynamic)
+    messages.extend(
+        {"role": role, "content": content}
+        for role, content in _coalesce(_trim_history(history))
+    )
     return messages
 
 
-def run_tourbot(
-    history: List[Dict[str, str]],
+# Saludos y agradecimientos sueltos se contestan con una frase fija, sin
+# llamar al modelo. "sí"/"no" quedan fuera: pueden confirmar un registro.
+_SMALLTALK = (
+    (
+        re.compile(r"^\W*(hola|buen[oa]s?( d[ií]as| tardes| noches)?)\W*$", re.IGNORECASE),
+        "¡Hola! Soy SAM, de Admisiones del Montebello. "
+        "¿Te gustaría registrarte para nuestro Tour Informativo?",
+    ),
+    (
+        re.compile(r"^\W*(muchas )?gracias\W*$", re.IGNORECASE),
+        "¡Con gusto! Si deseas, te ayudo a registrarte para el Tour Informativo.",
+    ),
+)
+
+
+# Temas claramente ajenos a admisiones; se redirige con la frase de
+# FUERA DE CONTEXTO del prompt. Nada que pueda ser una actividad del colegio
+# (deportes, cine, música, videojuegos son extracurriculares) ni "política",
+# que también se usa para reglamentos, ni "recetas" (menú del comedor) ni
+# "elecciones" (comité de padres, consejo estudiantil). Y solo si el mensaje no menciona nada
+# del colegio ("¿hay chistes en la obra escolar?" sí va al modelo).
+_OFF_TOPIC_RE = re.compile(
+    r"\b(chistes?|hor[oó]scopo|bitcoin|criptomonedas?)\b",
+    re.IGNORECASE,
+)
+_ON_TOPIC_RE = re.compile(
+    r"colegio|escuela|escolar|montebello|tour|admisi|grado|cupo|inscri|registr|"
+    r"matr[ií]cul|pensi|transporte|extracurricular|deport|equipo|entren|actividad|"
+    r"alimentaci|uniforme|hij[oa]s?\b|curso|clases?\b|alumn|estudiant",
+    re.IGNORECASE,
+)
+REPLY_OFF_TOPIC = (
+    "Ese tema no está relacionado con admisiones. "
+    "¿Deseas información acerca de nosotros?"
+)
+
+
+def canned_reply(text: str) -> Optional[str]:
+    """Respuesta fija para saludos, agradecimientos y temas fuera de contexto."""
+    for pattern, reply in _SMALLTALK:
+        if pattern.match(text):
+            return reply
+    if _OFF_TOPIC_RE.search(text) and not _ON_TOPIC_RE.search(text):
+        return REPLY_OFF_TOPIC
+    return None
+
+
+# Modelo barato para la charla; el fuerte solo para los turnos de registro,
+# donde la llamada a register_user() tiene que salir bien (ver main.py).
+TOURBOT_MODEL = "gpt-4o-mini"
+ESCALATION_MODEL = "gpt-4o"
+
+# Parámetros compartidos por la llamada normal y la de streaming.
+_TOURBOT_PARAMS = dict(
+    model=TOURBOT_MODEL,
+    # Todas las llamadas comparten el mismo prefijo; la misma clave ayuda a
+    # que caigan en el mismo caché de prompts.
+    prompt_cache_key="tourbot",
+    tools=[REGISTER_USER_FUNCTION],
+    tool_choice="auto",
+    max_output_tokens=150,
+    temperature=0.6,
+)
+
+
+# Caché exacto de respuestas: el mismo input (prompt, contexto, resumen e
+# historial) devuelve la respuesta anterior sin llamar a la API. Muchas
+# conversaciones empiezan con el mismo saludo y la misma pregunta. Solo se
+# guardan respuestas de texto; las llamadas a register_user siempre van a la API.
+TOURBOT_CACHE_SIZE = 1024
+_reply_cache: "OrderedDict[bytes, object]" = OrderedDict()
+_cache_stats = {
+    "hits": 0,
+    "template_hits": 0,
+    "semantic_hits": 0,
+    "misses": 0,
+    # Tokens de las llamadas a la API, para la tasa del caché de prompts.
+    "input_tokens": 0,
+    "cached_tokens": 0,
+}
+
+
+# build_messages siempre abre con _SYSTEM_MESSAGE: su parte del hash se
+# calcula una vez y cada clave solo serializa lo que viene después. El modelo
+# entra en la clave: una respuesta de gpt-4o-mini no sirve para un turno
+# escalado a gpt-4o.
+_STATIC_HASH = hashlib.blake2b(orjson.dumps(_SYSTEM_MESSAGE), digest_size=16)
+
+
+def _cache_key(msgs: list, model: str) -> bytes:
+    digest = _STATIC_HASH.copy()
+    digest.update(orjson.dumps([model, msgs[1:]]))
+    return digest.digest()
+
+
+# Caché semántico para la primera pregunta de cada conversación: ahí el
+# contexto es idéntico para todos (saludo fijo, sin resumen), así que una
+# paráfrasis cercana ("¿cuánto cuesta?" / "¿precio de la pensión?") puede
+# reutilizar la respuesta. Más adelante la respuesta depende del historial y
+# solo se usa el caché exacto. Las entradas se agrupan por el hash del input
+# sin la pregunta, de modo que un cambio de fechas o cupos las invalida.
+SEMANTIC_THRESHOLD = 0.93
+SEMANTIC_CACHE_SIZE = 128
+_EMBED_MODEL = "text-embedding-3-small"
+_EMBED_DIMENSIONS = 256
+# La búsqueda es solo un atajo: si el embedding tarda o falla se responde sin
+# caché, así que no se reintenta y el timeout es corto.
+_EMBED_TIMEOUT = 1.5
+_semantic_entries: "deque[tuple[bytes, List[float], object]]" = deque(maxlen=SEMANTIC_CACHE_SIZE)
+
+# Preguntas que nombran un grado, una fecha, un número o un correo: dos
+# paráfrasis casi idénticas ("¿hay cupo para 4to?" / "¿... para 1ro?") pueden
+# tener respuestas opuestas, así que solo usan el caché exacto. Cubre lo que
+# reconoce state_manager._GRADE_RE (no se puede importar: ese módulo importa
+# este) más los grados escritos con palabras.
+_SPECIFIC_RE = re.compile(
+    r"\d|@|\binicial\b|\b(primer[oa]?|segund[oa]|tercer[oa]?|cuart[oa]|quint[oa]|sext[oa])\b",
+    re.IGNORECASE,
+)
+
+
+def _is_first_question(history: List[Message], summary: str | None) -> bool:
+    return (
+        not summary
+        and bool(history)
+        and history[-1].role == "user"
+        and sum(1 for m in history if m.role == "user") == 1
+        and not _SPECIFIC_RE.search(history[-1].content)
+    )
+
+
+async def _embed(text: str) -> Optional[List[float]]:
+    try:
+        result = await _client.with_options(
+            timeout=_EMBED_TIMEOUT, max_retries=0
+        ).embeddings.create(
+            model=_EMBED_MODEL, input=text, dimensions=_EMBED_DIMENSIONS
+        )
+    except Exception as e:
+        logger.warning("Embedding failed: %s", e)
+        return None
+    vec = result.data[0].embedding
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+def _semantic_lookup(prefix: bytes, vec: List[float]):
+    best, best_score = None, SEMANTIC_THRESHOLD
+    for key, other, response in _semantic_entries:
+        if key == prefix:
+            score = sum(map(operator.mul, vec, other))
+            if score >= best_score:
+                best, best_score = response, score
+    return best
+
+
+def cache_metrics() -> dict:
+    """Contadores de los cachés y sus tasas de acierto desde el arranque."""
+    stats = dict(_cache_stats)
+    served = stats["hits"] + stats["template_hits"] + stats["semantic_hits"]
+    stats["reply_hit_ratio"] = served / max(served + stats["misses"], 1)
+    stats["prompt_cache_hit_ratio"] = stats["cached_tokens"] / max(stats["input_tokens"], 1)
+    return stats
+
+
+def record_usage(response) -> None:
+    """Token usage of a tourbot response (streamed or not): counters and log."""
+    usage = response.usage
+    if usage is None:
+        return
+    cached_tokens = usage.input_tokens_details.cached_tokens
+    _cache_stats["input_tokens"] += usage.input_tokens
+    _cache_stats["cached_tokens"] += cached_tokens
+    # Per call only at INFO: below OpenAI's 1024-token caching floor most
+    # calls show 0% cached, so alerting belongs on the aggregate ratio that
+    # cache_metrics() exposes at /metrics.json.
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(
+        "tokens in=%d cached=%d out=%d total=%d; "
+        "reply cache hits=%d template=%d semantic=%d misses=%d",
+        usage.input_tokens,
+        cached_tokens,
+        usage.output_tokens,
+        usage.total_tokens,
+        _cache_stats["hits"],
+        _cache_stats["template_hits"],
+        _cache_stats["semantic_hits"],
+        _cache_stats["misses"],
+    )
+
+
+async def _cached_reply(history: List[Message], summary: str | None, msgs: list, model: str):
+    """Busca la respuesta en los cachés (exacto, plantilla, semántico).
+
+    Devuelve (respuesta, None) en un acierto, o (None, slot) en un fallo;
+    el slot se pasa a _store_reply() con la respuesta de la API.
+    """
+    key = _cache_key(msgs, model)
+    cached = _reply_cache.get(key)
+    if cached is not None:
+        _reply_cache.move_to_end(key)
+        _cache_stats["hits"] += 1
+        return cached, None
+
+    # Misma conversación con otro correo: se reutiliza la plantilla de
+    # respuesta con el correo actual.
+    templated = gen_cache.lookup(msgs, model)
+    if templated is not None:
+        _cache_stats["template_hits"] += 1
+        return templated, None
+
+    vec = prefix = None
+    if _is_first_question(history, summary):
+        prefix = _cache_key(msgs[:-1], model)
+        vec = await _embed(history[-1].content)
+        if vec is not None:
+            similar = _semantic_lookup(prefix, vec)
+            if similar is not None:
+                _cache_stats["semantic_hits"] += 1
+                return similar, None
+    _cache_stats["misses"] += 1
+    return None, (key, prefix, vec, model)
+
+
+def _store_reply(msgs: list, response, slot) -> None:
+    if not response.output or response.output[0].type != "message":
+        return
+    key, prefix, vec, model = slot
+    _reply_cache[key] = response
+    if len(_reply_cache) > TOURBOT_CACHE_SIZE:
+        _reply_cache.popitem(last=False)
+    gen_cache.store(msgs, model, response)
+    if vec is not None:
+        _semantic_entries.append((prefix, vec, response))
+
+
+async def run_tourbot(
+    history: Iterable[Message],
     summary: str | None = None,
     tour_options_text: str | None = None,
     course_capacity_text: str | None = None,
+    model: str = TOURBOT_MODEL,
 ):
     """
     Llama a la API moderna de OpenAI usando responses.create()
@@ -95,21 +408,68 @@ def run_tourbot(
     if _client is None:
         raise RuntimeError("OpenAI client not initialized.")
 
+    history = list(history)
     msgs = build_messages(history, summary, tour_options_text, course_capacity_text)
 
-    response = _client.responses.create(
-        model="gpt-4o-mini",
-        input=msgs,                   
-        tools=[REGISTER_USER_FUNCTION],
-        tool_choice="auto",
-        max_output_tokens=150,
-        temperature=0.6,
-    )
-    usage = response.usage
-    print("\n[run_tourbot] TOKENS:")
-    print(f"  Input tokens:   {usage.input_tokens}")
-    print(f"  Output tokens:  {usage.output_tokens}")
-    print(f"  Total tokens:   {usage.total_tokens}")
-    print("=" * 40)
+    cached, slot = await _cached_reply(history, summary, msgs, model)
+    if cached is not None:
+        return cached
+
+    response = await _client.responses.create(input=msgs, **{**_TOURBOT_PARAMS, "model": model})
+    _store_reply(msgs, response, slot)
+    record_usage(response)
 
     return response
+
+
+class _StreamEvent(NamedTuple):
+    """Evento con la forma de los del SDK, para respuestas servidas desde caché."""
+
+    type: str
+    delta: str = ""
+    response: object = None
+
+
+async def _replay(response):
+    # El texto completo sale como un único delta.
+    yield _StreamEvent("response.output_text.delta", delta=response.output[0].content[0].text)
+    yield _StreamEvent("response.completed", response=response)
+
+
+async def _passthrough(stream, msgs: list, slot):
+    async for event in stream:
+        if event.type in ("response.completed", "response.incomplete", "response.failed"):
+            record_usage(event.response)
+            if event.type == "response.completed":
+                _store_reply(msgs, event.response, slot)
+        yield event
+
+
+async def stream_tourbot(
+    history: Iterable[Message],
+    summary: str | None = None,
+    tour_options_text: str | None = None,
+    course_capacity_text: str | None = None,
+    model: str = TOURBOT_MODEL,
+):
+    """
+    Igual que run_tourbot, pero con stream=True: devuelve el iterador
+    asíncrono de eventos. El texto llega en eventos
+    "response.output_text.delta" y la respuesta completa en
+    "response.completed". Usa los mismos cachés: un acierto llega como un
+    solo delta, y las respuestas completas de la API se guardan en ellos.
+    """
+    if _client is None:
+        raise RuntimeError("OpenAI client not initialized.")
+
+    history = list(history)
+    msgs = build_messages(history, summary, tour_options_text, course_capacity_text)
+
+    cached, slot = await _cached_reply(history, summary, msgs, model)
+    if cached is not None:
+        return _replay(cached)
+
+    stream = await _client.responses.create(
+        input=msgs, stream=True, **{**_TOURBOT_PARAMS, "model": model}
+    )
+    return _passthrough(stream, msgs, slot)